@@ -3,23 +3,40 @@ GitHub Events Consumer
 ──────────────────────
 Reads raw events from  github.events.raw,
 enriches each actor with geographic + profile data,
-and writes rows to TimescaleDB.
+and writes rows to TimescaleDB from a dedicated writer thread.
 
 Environment variables:
   KAFKA_BOOTSTRAP_SERVERS
   DB_HOST / DB_PORT / DB_NAME / DB_USER / DB_PASSWORD
+  BATCH_SIZE               (default: 500)
+  MAX_BATCH_LATENCY_SECONDS (default: 1)
+  ENRICH_WORKERS           (default: 16)
+  ENRICH_BUDGET_SECONDS    (default: 120)
+  CACHE_DIR                (default: /var/cache/github-consumer)
+  KAFKA_FETCH_MIN_BYTES    (default: 1048576)
+  KAFKA_FETCH_WAIT_MS      (default: 500)
+  DB_SYNCHRONOUS_COMMIT    (default: on)
+  DB_QUEUE_SIZE            (default: 2000)
 """
 
-import json
+import io
 import logging
 import os
+import queue
+import signal
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 
+import ciso8601
+import orjson
 import psycopg2
-import psycopg2.extras
 import requests
-from confluent_kafka import Consumer, KafkaError
+from confluent_kafka import Consumer, KafkaError, KafkaException, TopicPartition
+from diskcache import Cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # ── Logging ──────────────────────────────────────────────────────
 logging.basicConfig(
@@ -32,6 +49,22 @@ log = logging.getLogger(__name__)
 BOOTSTRAP_SERVERS = os.getenv("KAFKA_BOOTSTRAP_SERVERS", "localhost:9092")
 TOPIC_RAW         = "github.events.raw"
 GROUP_ID          = "github-events-enricher"
+FETCH_MIN_BYTES   = int(os.getenv("KAFKA_FETCH_MIN_BYTES", str(1024 * 1024)))
+FETCH_WAIT_MS     = int(os.getenv("KAFKA_FETCH_WAIT_MS", "500"))
+
+BATCH_SIZE        = int(os.getenv("BATCH_SIZE", "500"))
+MAX_LATENCY_S     = float(os.getenv("MAX_BATCH_LATENCY_SECONDS", "1"))
+MAX_FLUSH_RETRIES = 3
+DB_QUEUE_SIZE     = int(os.getenv("DB_QUEUE_SIZE", "2000"))
+ENRICH_WORKERS    = int(os.getenv("ENRICH_WORKERS", "16"))
+# Lookups a batch may start before its uncached actors/locations are deferred;
+# keeps consume() calls well inside max.poll.interval.ms on a cold cache.
+ENRICH_BUDGET_S   = float(os.getenv("ENRICH_BUDGET_SECONDS", "120"))
+# Slack on top of the budget for lookups already in flight (timeouts + retries)
+MAX_POLL_INTERVAL_MS = max(300_000, int((ENRICH_BUDGET_S + 120) * 1000))
+CACHE_DIR         = os.getenv("CACHE_DIR", "/var/cache/github-consumer")
+USER_CACHE_TTL    = 24 * 3600          # profiles change occasionally
+GEOCODE_CACHE_TTL = 30 * 24 * 3600     # place names practically never move
 
 DB_DSN = (
     f"host={os.getenv('DB_HOST', 'localhost')} "
@@ -40,6 +73,9 @@ DB_DSN = (
     f"user={os.getenv('DB_USER', 'github')} "
     f"password={os.getenv('DB_PASSWORD', 'github_secret')}"
 )
+# "off" skips the WAL fsync wait per commit; a DB crash may then lose the
+# last few batches, which Kafka cannot re-deliver once their offsets are committed.
+DB_SYNCHRONOUS_COMMIT = os.getenv("DB_SYNCHRONOUS_COMMIT", "on")
 
 GITHUB_TOKEN   = os.getenv("GITHUB_TOKEN", "")
 NOMINATIM_URL  = "https://nominatim.openstreetmap.org/search"
@@ -57,29 +93,72 @@ NOMINATIM_HEADERS = {
     "Accept-Language": "en",
 }
 
-# ── In-memory caches (survive within one container lifetime) ─────
-user_cache:    dict[str, dict] = {}
-geocode_cache: dict[str, dict] = {}
+# ── On-disk LRU caches (survive container restarts, thread-safe) ──
+user_cache = Cache(
+    os.path.join(CACHE_DIR, "users"),
+    size_limit=2**30,
+    eviction_policy="least-recently-used",
+)
+geocode_cache = Cache(
+    os.path.join(CACHE_DIR, "geocode"),
+    size_limit=2**28,
+    eviction_policy="least-recently-used",
+)
+
+# GitHub profiles are fetched concurrently; Nominatim lookups go through a
+# single worker so cache misses still respect its 1 req/s policy.
+profile_pool = ThreadPoolExecutor(max_workers=ENRICH_WORKERS, thread_name_prefix="profile")
+geocode_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="geocode")
+
+_local = threading.local()
+
+
+def _thread_session(name: str, max_retries) -> requests.Session:
+    """One pooled keep-alive session per thread and API (requests.Session is not thread-safe)."""
+    session = getattr(_local, name, None)
+    if session is None:
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=32,
+            max_retries=max_retries,
+        ))
+        setattr(_local, name, session)
+    return session
+
+
+def github_session() -> requests.Session:
+    return _thread_session("github", Retry(
+        total=3, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504),
+    ))
+
+
+def nominatim_session() -> requests.Session:
+    # No automatic retries: urllib3 retries the first time without waiting,
+    # which would break the 1 req/s spacing _geocode enforces.
+    return _thread_session("nominatim", 0)
 
 
 # ── Enrichment helpers ────────────────────────────────────────────
 
-def geocode(location: str) -> dict:
-    if not location:
-        return {}
+def _geocode(location: str, deadline: float) -> dict | None:
     key = location.lower().strip()
-    if key in geocode_cache:
-        return geocode_cache[key]
+    cached = geocode_cache.get(key)
+    if cached is not None:
+        return cached
+    if time.monotonic() > deadline:
+        return None   # deferred: looked up again the next time this actor shows up
 
-    result: dict = {}
+    result: dict | None = None
     try:
-        r = requests.get(
+        r = nominatim_session().get(
             NOMINATIM_URL,
             headers=NOMINATIM_HEADERS,
             params={"q": location, "format": "json", "limit": 1, "addressdetails": 1},
             timeout=8,
         )
         if r.status_code == 200:
+            result = {}
             hits = r.json()
             if hits:
                 h   = hits[0]
@@ -93,27 +172,41 @@ def geocode(location: str) -> dict:
     except requests.RequestException:
         pass
 
-    geocode_cache[key] = result
+    # Only real answers are cached; 429/5xx/timeouts are retried on a later batch
+    if result is not None:
+        geocode_cache.set(key, result, expire=GEOCODE_CACHE_TTL)
     time.sleep(1.1)   # Nominatim policy: ≤ 1 req/s
     return result
 
 
-def fetch_profile(username: str) -> dict:
-    if username in user_cache:
-        return user_cache[username]
+def geocode(location: str, deadline: float = float("inf")) -> dict | None:
+    """Geocode via the single Nominatim worker; None if deferred or failed."""
+    if not location:
+        return {}
+    return geocode_pool.submit(_geocode, location, deadline).result()
+
+
+def fetch_profile(username: str, deadline: float = float("inf")) -> dict:
+    cached = user_cache.get(username)
+    if cached is not None:
+        return cached
 
     profile: dict = {
         "location": None, "company": None, "public_repos": None,
         "country": None, "country_code": None,
         "lat": None, "lng": None,
     }
+    if time.monotonic() > deadline:
+        return profile   # deferred, not cached
 
+    cacheable = False   # only a 200 or 404 is a real answer worth keeping
     try:
-        r = requests.get(
+        r = github_session().get(
             f"{GITHUB_API_BASE}/{username}",
             headers=GITHUB_HEADERS,
             timeout=8,
         )
+        cacheable = r.status_code in (200, 404)
         if r.status_code == 200:
             d = r.json()
             profile["location"]     = d.get("location") or None
@@ -123,13 +216,55 @@ def fetch_profile(username: str) -> dict:
         pass
 
     if profile["location"]:
-        geo = geocode(profile["location"])
+        geo = geocode(profile["location"], deadline)
+        if geo is None:
+            return profile   # incomplete, so not cached
         profile.update({k: geo.get(k) for k in ("country", "country_code", "lat", "lng")})
 
-    user_cache[username] = profile
+    if cacheable:
+        user_cache.set(username, profile, expire=USER_CACHE_TTL)
     return profile
 
 
+def enrich(events: list[dict]) -> list[tuple[dict, dict]]:
+    """
+    Pair each event with its actor's profile, looking every actor up only once.
+    Lookups not started within ENRICH_BUDGET_S are skipped for this batch.
+    """
+    deadline = time.monotonic() + ENRICH_BUDGET_S
+    actors = [event.get("actor", {}).get("login", "") for event in events]
+
+    profiles: dict[str, dict] = {}
+    missing: list[str] = []
+    for actor in dict.fromkeys(actors):        # unique, in first-seen order
+        cached = user_cache.get(actor)
+        if cached is None:
+            missing.append(actor)
+        else:
+            profiles[actor] = cached
+    profiles.update(zip(missing, profile_pool.map(
+        lambda actor: fetch_profile(actor, deadline), missing,
+    )))
+
+    return [(event, profiles[actor]) for event, actor in zip(events, actors)]
+
+
+# ── Validation ───────────────────────────────────────────────────
+
+def missing_field(event) -> str | None:
+    """Name of the first field a NOT NULL column needs that the event lacks, or None."""
+    if not isinstance(event, dict):
+        return "event"
+    for field in ("id", "type"):
+        if not event.get(field):
+            return field
+    for parent, key in (("actor", "login"), ("repo", "name")):
+        obj = event.get(parent)
+        if not isinstance(obj, dict) or not obj.get(key):
+            return f"{parent}.{key}"
+    return None
+
+
 # ── Detail extractor (mirrors the producer-side logic) ───────────
 
 def extract_detail(event: dict) -> str:
@@ -150,23 +285,42 @@ def extract_detail(event: dict) -> str:
 
 # ── DB writer ─────────────────────────────────────────────────────
 
-INSERT_SQL = """
-INSERT INTO events (
-    time, event_id, event_type, actor, repo, detail,
-    location, country, country_code, lat, lng,
-    company, public_repos, payload
-) VALUES (
-    %(time)s, %(event_id)s, %(event_type)s, %(actor)s, %(repo)s, %(detail)s,
-    %(location)s, %(country)s, %(country_code)s, %(lat)s, %(lng)s,
-    %(company)s, %(public_repos)s, %(payload)s
+COLUMNS = (
+    "time, event_id, event_type, actor, repo, detail, "
+    "location, country, country_code, lat, lng, "
+    "company, public_repos, payload"
 )
-ON CONFLICT DO NOTHING;
+
+# Every batch is streamed with COPY into an UNLOGGED staging table (no WAL,
+# and COPY has no ON CONFLICT), then merged into the hypertable in the same
+# transaction, so WAL is written once per batch by the merge.
+STAGE_SQL = """
+CREATE UNLOGGED TABLE IF NOT EXISTS events_stage (LIKE events INCLUDING DEFAULTS);
+"""
+LOCK_STAGE_SQL     = "LOCK TABLE events_stage;"   # one writer at a time across consumers
+COPY_SQL           = f"COPY events_stage ({COLUMNS}) FROM STDIN WITH (FORMAT text)"
+TRUNCATE_STAGE_SQL = "TRUNCATE events_stage;"
+MERGE_SQL = f"""
+INSERT INTO events ({COLUMNS})
+SELECT {COLUMNS} FROM events_stage
+ON CONFLICT (time, event_id) DO NOTHING;
+"""
+
+# Brings databases initialised by an older init.sql in line with the current
+# index layout: BRIN on time instead of TimescaleDB's default time btree.
+INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS idx_events_time_brin ON events USING BRIN (time);
+DROP INDEX IF EXISTS events_time_idx;
 """
 
 def db_connect():
     while True:
         try:
             conn = psycopg2.connect(DB_DSN)
+            with conn.cursor() as cur:
+                cur.execute("SET synchronous_commit = %s", (DB_SYNCHRONOUS_COMMIT,))
+                cur.execute(STAGE_SQL)
+            conn.commit()
             log.info("Connected to TimescaleDB")
             return conn
         except psycopg2.OperationalError as e:
@@ -174,29 +328,209 @@ def db_connect():
             time.sleep(3)
 
 
-def write_event(cur, event: dict, profile: dict):
+def ensure_indexes(conn):
+    with conn.cursor() as cur:
+        cur.execute(INDEX_SQL)
+    conn.commit()
+
+
+def build_row(event: dict, profile: dict) -> tuple:
+    """Turn one event + its actor profile into a row (column order of COLUMNS)."""
     ts_raw = event.get("created_at", "")
     try:
-        ts = datetime.strptime(ts_raw, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+        ts = ciso8601.parse_datetime(ts_raw)
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
     except ValueError:
         ts = datetime.now(timezone.utc)
 
-    cur.execute(INSERT_SQL, {
-        "time":         ts,
-        "event_id":     event.get("id"),
-        "event_type":   event.get("type"),
-        "actor":        event.get("actor", {}).get("login"),
-        "repo":         event.get("repo",  {}).get("name"),
-        "detail":       extract_detail(event),
-        "location":     profile.get("location"),
-        "country":      profile.get("country"),
-        "country_code": profile.get("country_code"),
-        "lat":          profile.get("lat"),
-        "lng":          profile.get("lng"),
-        "company":      profile.get("company"),
-        "public_repos": profile.get("public_repos"),
-        "payload":      psycopg2.extras.Json(event.get("payload", {})),
-    })
+    return (
+        ts,
+        event.get("id"),
+        event.get("type"),
+        event.get("actor", {}).get("login"),
+        event.get("repo",  {}).get("name"),
+        extract_detail(event),
+        profile.get("location"),
+        profile.get("country"),
+        profile.get("country_code"),
+        profile.get("lat"),
+        profile.get("lng"),
+        profile.get("company"),
+        profile.get("public_repos"),
+        orjson.dumps(event.get("payload", {})).decode(),
+    )
+
+
+def _copy_text(v) -> str:
+    """Text column in COPY text format: \\N for NULL, backslash escapes."""
+    if v is None:
+        return "\\N"
+    return (
+        str(v)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def _copy_plain(v) -> str:
+    """Numeric column: its str() can never contain a character COPY must escape."""
+    return "\\N" if v is None else str(v)
+
+
+# One formatter per entry of COLUMNS, resolved once instead of per value
+COPY_FORMATTERS = (
+    datetime.isoformat,                                  # time (always set)
+    _copy_text, _copy_text, _copy_text, _copy_text,      # event_id, event_type, actor, repo
+    _copy_text, _copy_text, _copy_text, _copy_text,      # detail, location, country, country_code
+    _copy_plain, _copy_plain,                            # lat, lng
+    _copy_text, _copy_plain,                             # company, public_repos
+    _copy_text,                                          # payload (pre-serialized JSON)
+)
+
+
+def flush_rows(cur, rows: list[tuple]):
+    """COPY a batch into events_stage and merge it into events (caller commits)."""
+    # Time-ordered writes keep TimescaleDB appending to the hot chunk
+    rows.sort(key=lambda r: r[0])
+
+    buf = io.StringIO("".join(
+        "\t".join([fmt(v) for fmt, v in zip(COPY_FORMATTERS, row)]) + "\n"
+        for row in rows
+    ))
+
+    cur.execute(LOCK_STAGE_SQL)
+    cur.copy_expert(COPY_SQL, buf)
+    cur.execute(MERGE_SQL)
+    cur.execute(TRUNCATE_STAGE_SQL)
+
+
+def write_rows(conn, cur, rows: list[tuple]) -> int:
+    """
+    Write and commit rows, returning how many were skipped. Rows the DB
+    rejects (constraint violations, invalid jsonb, …) are isolated by
+    bisecting the batch, so only they are lost. Connection errors propagate.
+    """
+    try:
+        flush_rows(cur, rows)
+        conn.commit()
+        return 0
+    except (psycopg2.DataError, psycopg2.IntegrityError) as exc:
+        conn.rollback()
+        if len(rows) == 1:
+            log.warning("Skipping event %s rejected by the DB: %s", rows[0][1], exc)
+            return 1
+    mid = len(rows) // 2
+    return write_rows(conn, cur, rows[:mid]) + write_rows(conn, cur, rows[mid:])
+
+
+# ── Writer thread ─────────────────────────────────────────────────
+
+_STOP = object()   # sentinel: drain what is queued, then exit
+
+
+def db_writer(db_q: queue.Queue, commit_q: queue.Queue):
+    """
+    Drain (row, (topic, partition), offset) items from db_q in batches of up
+    to BATCH_SIZE rows or MAX_LATENCY_S, write them, and hand the offsets of
+    every committed batch back to the consumer thread through commit_q.
+    """
+    conn = db_connect()
+    ensure_indexes(conn)
+    cur  = conn.cursor()
+    processed = 0
+    errors    = 0
+    stopping  = False
+
+    while not stopping:
+        item = db_q.get()
+        if item is _STOP:
+            break
+
+        rows: list[tuple] = []
+        offsets: dict[tuple[str, int], int] = {}
+        deadline = time.monotonic() + MAX_LATENCY_S
+        while True:
+            row, tp, offset = item
+            rows.append(row)
+            offsets[tp] = offset
+            if len(rows) >= BATCH_SIZE:
+                break
+            try:
+                item = db_q.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stopping = True
+                break
+
+        for attempt in range(1, MAX_FLUSH_RETRIES + 1):
+            try:
+                skipped = write_rows(conn, cur, rows)
+                break
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as exc:
+                log.error("DB batch write failed (%d rows, attempt %d/%d): %s",
+                          len(rows), attempt, MAX_FLUSH_RETRIES, exc)
+                errors += 1
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                # Re-connect and retry the same batch
+                conn = db_connect()
+                cur  = conn.cursor()
+        else:
+            # Never drop the batch: its offsets stay uncommitted, so after the
+            # restart Kafka re-delivers it instead of later batches skipping past it.
+            raise RuntimeError(f"DB batch write failed {MAX_FLUSH_RETRIES} times")
+
+        # Kafka offsets only move once the whole batch is durable in the DB
+        commit_q.put(offsets)
+        errors    += skipped
+        processed += len(rows) - skipped
+        log.info(
+            "Processed %d events | users cached: %d | geocodes: %d | DB errors: %d",
+            processed, len(user_cache), len(geocode_cache), errors,
+        )
+
+    conn.close()
+
+
+def commit_offsets(consumer: Consumer, commit_q: queue.Queue):
+    """Commit every offset the writer has confirmed so far (consumer thread only)."""
+    offsets: dict[tuple[str, int], int] = {}
+    while True:
+        try:
+            offsets.update(commit_q.get_nowait())
+        except queue.Empty:
+            break
+    if not offsets:
+        return
+    try:
+        consumer.commit(
+            offsets=[TopicPartition(t, p, o + 1) for (t, p), o in offsets.items()],
+            asynchronous=False,
+        )
+    except KafkaException as exc:
+        # e.g. partition revoked by a rebalance; its new owner re-reads the tail
+        log.warning("Offset commit failed: %s", exc)
+
+
+def enqueue(db_q: queue.Queue, writer: threading.Thread, item):
+    """put() that blocks while the writer lags, but never on a dead writer."""
+    while True:
+        try:
+            db_q.put(item, timeout=1.0)
+            return
+        except queue.Full:
+            if not writer.is_alive():
+                raise RuntimeError("DB writer thread died")
+
+
+def _raise_interrupt(signum, frame):
+    raise KeyboardInterrupt
 
 
 # ── Main consumer loop ────────────────────────────────────────────
@@ -213,68 +547,83 @@ def main():
         "group.id":                 GROUP_ID,
         "auto.offset.reset":        "earliest",
         "enable.auto.commit":       False,       # manual commit after DB write
-        "max.poll.interval.ms":     300_000,
+        "max.poll.interval.ms":     MAX_POLL_INTERVAL_MS,
         "session.timeout.ms":       30_000,
+        # Fewer, larger fetches → fuller consume() batches
+        "fetch.min.bytes":          FETCH_MIN_BYTES,
+        "fetch.wait.max.ms":        FETCH_WAIT_MS,
+        "max.partition.fetch.bytes": 10 * 1024 * 1024,
+        "queued.min.messages":      100_000,
     })
     consumer.subscribe([TOPIC_RAW])
+    # `docker stop` sends SIGTERM: take the same drain-and-commit path as Ctrl-C
+    signal.signal(signal.SIGTERM, _raise_interrupt)
 
-    conn = db_connect()
-    cur  = conn.cursor()
+    # Enrichment (HTTP-bound) runs here; DB writes run on their own thread
+    db_q:     queue.Queue = queue.Queue(maxsize=DB_QUEUE_SIZE)
+    commit_q: queue.Queue = queue.Queue()
+    writer = threading.Thread(target=db_writer, args=(db_q, commit_q),
+                              name="db-writer", daemon=True)
+    writer.start()
 
-    processed = 0
-    errors    = 0
+    errors = 0
 
     try:
         while True:
-            msg = consumer.poll(timeout=2.0)
+            if not writer.is_alive():
+                raise RuntimeError("DB writer thread died")
+
+            msgs = consumer.consume(num_messages=BATCH_SIZE, timeout=1.0)
+
+            events: list[dict] = []
+            sources = []
+            for msg in msgs:
+                if msg.error():
+                    if msg.error().code() != KafkaError._PARTITION_EOF:
+                        log.error("Kafka error: %s", msg.error())
+                        errors += 1
+                    continue
 
-            if msg is None:
-                continue
+                try:
+                    event = orjson.loads(msg.value())
+                except orjson.JSONDecodeError as exc:
+                    log.warning("Skipping malformed message: %s", exc)
+                    errors += 1
+                    continue
 
-            if msg.error():
-                if msg.error().code() == KafkaError._PARTITION_EOF:
+                # Rows missing a NOT NULL column would only be rejected by the DB
+                missing = missing_field(event)
+                if missing:
+                    log.warning("Skipping message without %s at offset %d", missing, msg.offset())
+                    errors += 1
                     continue
-                log.error("Kafka error: %s", msg.error())
-                errors += 1
-                continue
 
-            try:
-                event   = json.loads(msg.value().decode("utf-8"))
-                actor   = event.get("actor", {}).get("login", "")
-                profile = fetch_profile(actor)
-
-                write_event(cur, event, profile)
-                conn.commit()
-                consumer.commit(asynchronous=False)
-
-                processed += 1
-                if processed % 50 == 0:
-                    log.info(
-                        "Processed %d events | users cached: %d | geocodes: %d | errors: %d",
-                        processed, len(user_cache), len(geocode_cache), errors,
-                    )
-
-            except (json.JSONDecodeError, KeyError) as exc:
-                log.warning("Skipping malformed message: %s", exc)
-                conn.rollback()
-                errors += 1
-            except psycopg2.Error as exc:
-                log.error("DB write failed: %s", exc)
-                conn.rollback()
-                # Re-connect if connection was lost
+                events.append(event)
+                sources.append(((msg.topic(), msg.partition()), msg.offset()))
+
+            for (event, profile), (tp, offset) in zip(enrich(events), sources):
                 try:
-                    conn.close()
-                except Exception:
-                    pass
-                conn = db_connect()
-                cur  = conn.cursor()
-                errors += 1
+                    row = build_row(event, profile)
+                except (AttributeError, TypeError, ValueError) as exc:
+                    # e.g. "payload": null, or a created_at that is not a string
+                    log.warning("Skipping malformed message at offset %d: %s", offset, exc)
+                    errors += 1
+                    continue
+                enqueue(db_q, writer, (row, tp, offset))
+
+            commit_offsets(consumer, commit_q)
 
     except KeyboardInterrupt:
         log.info("Shutting down…")
     finally:
+        try:
+            enqueue(db_q, writer, _STOP)   # writer flushes everything queued before it
+            writer.join()
+        except RuntimeError:
+            log.error("DB writer thread died; unflushed events are re-read on restart")
+        commit_offsets(consumer, commit_q)
         consumer.close()
-        conn.close()
+        log.info("Stopped (%d consumer-side errors)", errors)
 
 
 if __name__ == "__main__":
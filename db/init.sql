@@ -32,20 +32,29 @@ CREATE TABLE IF NOT EXISTS events (
     PRIMARY KEY (time, event_id)
 );
 
--- Convert to hypertable, partitioned by time (1 day chunks)
+-- Convert to hypertable, partitioned by time (1 day chunks).
+-- The default btree on time is skipped: the (time, event_id) primary key
+-- already serves time-range scans, and a BRIN index covers the rest.
 SELECT create_hypertable(
     'events', 'time',
-    chunk_time_interval => INTERVAL '1 day',
-    if_not_exists       => TRUE
+    chunk_time_interval    => INTERVAL '1 day',
+    create_default_indexes => FALSE,
+    if_not_exists          => TRUE
 );
 
 -- ── Indexes ──────────────────────────────────────────────────────
+CREATE INDEX IF NOT EXISTS idx_events_time_brin    ON events USING BRIN (time);
 CREATE INDEX IF NOT EXISTS idx_events_type         ON events (event_type, time DESC);
 CREATE INDEX IF NOT EXISTS idx_events_country      ON events (country, time DESC);
 CREATE INDEX IF NOT EXISTS idx_events_actor        ON events (actor, time DESC);
 CREATE INDEX IF NOT EXISTS idx_events_repo         ON events (repo, time DESC);
 CREATE INDEX IF NOT EXISTS idx_events_payload_gin  ON events USING GIN (payload);
 
+-- ── Ingest staging table ─────────────────────────────────────────
+-- UNLOGGED: no WAL. The consumer COPYs each batch in here and merges it into
+-- events within one transaction; on a crash Kafka re-delivers the batch.
+CREATE UNLOGGED TABLE IF NOT EXISTS events_stage (LIKE events INCLUDING DEFAULTS);
+
 -- ── Compression (after 7 days, chunks are compressed ~10-20x) ───
 ALTER TABLE events SET (
     timescaledb.compress,
@@ -9,17 +9,24 @@ Environment variables:
   GITHUB_TOKEN             (optional, raises rate limit to 5000 req/h)
   POLL_INTERVAL_SECONDS    (default: 10)
   MAX_PAGES                (default: 3)
+  KAFKA_LINGER_MS          (default: 500)
 """
 
-import json
+import atexit
 import os
+import signal
+import sys
 import time
 import logging
+from collections import OrderedDict
 from datetime import datetime, timezone
 
+import orjson
 import requests
 from confluent_kafka import Producer
 from confluent_kafka.admin import AdminClient, NewTopic
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # ── Logging ──────────────────────────────────────────────────────
 logging.basicConfig(
@@ -34,6 +41,9 @@ TOPIC_RAW            = "github.events.raw"
 POLL_INTERVAL        = int(os.getenv("POLL_INTERVAL_SECONDS", "10"))
 MAX_PAGES            = int(os.getenv("MAX_PAGES", "3"))
 TOKEN                = os.getenv("GITHUB_TOKEN", "")
+SEEN_IDS_MAX         = 10_000
+LINGER_MS            = int(os.getenv("KAFKA_LINGER_MS", "500"))
+QUEUE_MAX_MESSAGES   = 100_000
 
 GITHUB_HEADERS = {
     "Accept":     "application/vnd.github+json",
@@ -44,6 +54,14 @@ if TOKEN:
 
 GITHUB_API_URL = "https://api.github.com/events"
 
+# Shared keep-alive session: paginated requests reuse one TLS connection
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504)),
+))
+
 # ── Kafka setup ───────────────────────────────────────────────────
 
 def create_producer() -> Producer:
@@ -52,35 +70,37 @@ def create_producer() -> Producer:
         "acks":                         "all",
         "retries":                      5,
         "retry.backoff.ms":             500,
-        "compression.type":             "snappy",
-        "batch.num.messages":           500,
-        "linger.ms":                    200,          # small batching window
-        "queue.buffering.max.messages": 100_000,
+        "compression.type":             "zstd",       # repetitive JSON keys compress well
+        "batch.num.messages":           5_000,
+        "linger.ms":                    LINGER_MS,    # batching window
+        "queue.buffering.max.messages": QUEUE_MAX_MESSAGES,
     })
 
 
 def delivery_report(err, msg):
     if err:
-        log.error("Delivery failed for event %s: %s", msg.key(), err)
+        log.error("Delivery failed for key %s: %s", msg.key(), err)
 
 
 # ── State ─────────────────────────────────────────────────────────
-seen_ids:  set  = set()
-last_etag: str  = ""
+seen_ids:  OrderedDict[str, None] = OrderedDict()   # insertion-ordered → FIFO trim
+etags:     dict[int, str] = {}   # page → ETag of its last 200 response
 poll_count: int = 0
 sent_total: int = 0
 
 
 def fetch_events() -> list[dict]:
-    """Fetch new events from the GitHub API, skipping already-seen IDs."""
-    global last_etag, sent_total
+    """Fetch new events from the GitHub API, skipping already-seen IDs.
 
+    The API returns newest events first, so paging stops at the first page
+    that holds nothing new — deeper pages can only be older.
+    """
     new_events: list[dict] = []
-    etag_headers = {"If-None-Match": last_etag} if last_etag else {}
 
     for page in range(1, MAX_PAGES + 1):
+        etag_headers = {"If-None-Match": etags[page]} if etags.get(page) else {}
         try:
-            resp = requests.get(
+            resp = _session.get(
                 GITHUB_API_URL,
                 headers={**GITHUB_HEADERS, **etag_headers},
                 params={"per_page": 30, "page": page},
@@ -100,14 +120,23 @@ def fetch_events() -> list[dict]:
 
             resp.raise_for_status()
 
-            if page == 1:
-                last_etag = resp.headers.get("ETag", "")
+            etag = resp.headers.get("ETag")
+            if etag:
+                etags[page] = etag
+            else:
+                etags.pop(page, None)
 
+            added_this_page = 0
             for event in resp.json():
                 eid = event.get("id")
                 if eid and eid not in seen_ids:
-                    seen_ids.add(eid)
+                    seen_ids[eid] = None
                     new_events.append(event)
+                    added_this_page += 1
+
+            if not added_this_page:
+                log.debug("Page %d held no new events — skipping older pages", page)
+                break
 
         except requests.RequestException as exc:
             log.warning("GitHub API request failed: %s", exc)
@@ -120,20 +149,34 @@ def publish_events(producer: Producer, events: list[dict]) -> int:
     """Serialize and publish events to Kafka; returns count sent."""
     global sent_total
 
+    sent = 0
+    ingested_at = datetime.now(timezone.utc).isoformat()   # one timestamp per poll batch
     for event in events:
-        event["_ingested_at"] = datetime.now(timezone.utc).isoformat()
+        event["_ingested_at"] = ingested_at
+        try:
+            value = orjson.dumps(event, default=str)
+        except TypeError as exc:
+            # e.g. an integer wider than 64 bits, which orjson refuses to encode
+            log.warning("Skipping unserializable event %s: %s", event.get("id"), exc)
+            continue
+
+        # Back-pressure: let librdkafka drain before its local queue overflows
+        while len(producer) > QUEUE_MAX_MESSAGES * 0.9:
+            producer.poll(0.1)
 
         producer.produce(
             topic     = TOPIC_RAW,
-            key       = event.get("id", ""),
-            value     = json.dumps(event, default=str),
+            # Same actor → same partition, so one consumer keeps that actor's profile hot
+            key       = (event.get("actor") or {}).get("login") or event.get("id", ""),
+            value     = value,
             callback  = delivery_report,
         )
         producer.poll(0)   # serve delivery callbacks without blocking
+        sent += 1
 
-    producer.flush(timeout=10)
-    sent_total += len(events)
-    return len(events)
+    # No flush here: messages keep batching across poll cycles (linger.ms)
+    sent_total += sent
+    return sent
 
 
 def main():
@@ -146,6 +189,8 @@ def main():
     log.info("  GitHub auth       : %s", "yes (token)" if TOKEN else "no (60 req/h limit)")
 
     producer = create_producer()
+    atexit.register(producer.flush, 30)   # deliver whatever is still queued on shutdown
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))   # `docker stop` → run atexit hooks
 
     while True:
         poll_count += 1
@@ -159,12 +204,11 @@ def main():
             )
         else:
             log.info("Poll #%d → no new events", poll_count)
+            producer.poll(0)   # still serve delivery callbacks from earlier cycles
 
-        # Trim seen_ids to avoid unbounded growth (keep last 10 k)
-        if len(seen_ids) > 10_000:
-            surplus = len(seen_ids) - 8_000
-            for _ in range(surplus):
-                seen_ids.pop()
+        # Trim seen_ids to avoid unbounded growth (drop the oldest IDs first)
+        while len(seen_ids) > SEEN_IDS_MAX:
+            seen_ids.popitem(last=False)
 
         time.sleep(POLL_INTERVAL)
 